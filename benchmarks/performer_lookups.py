@@ -0,0 +1,168 @@
+"""
+Count the Spotify artist lookups that a playlist build makes with and
+without performer name normalization, using pages of events recorded
+in a `Checkpoint` file, e.g.
+
+    api.parsed_events(limit=1000, checkpoint=Checkpoint('recorded.jsonl'))
+
+Usage (from the root of the repository):
+    python benchmarks/performer_lookups.py [recorded.jsonl [splits.json]]
+
+Without arguments, benchmarks/data/sample.checkpoint.jsonl is used with
+the splits in benchmarks/data/sample.expected_names.json. A splits file
+maps listing names to the performers they actually name, and recorded
+listing names that are split differently are reported as wrong splits.
+
+Listing names in benchmarks/data/expected_names.json are regression
+cases, and the benchmark exits with an error if any of them is split
+wrongly.
+"""
+import json
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from local_concert_playlist import (  # noqa: E402
+    canonical_performer_names,
+    Checkpoint,
+    normalize_performer_name,
+    OhMyRocknessAPI,
+    SeatGeekAPI,
+    SpotifyPlaylist
+)
+
+DATA = os.path.join(ROOT, 'benchmarks', 'data')
+SAMPLE = os.path.join(DATA, 'sample.checkpoint.jsonl')
+SAMPLE_EXPECTED = os.path.join(DATA, 'sample.expected_names.json')
+EXPECTED = os.path.join(DATA, 'expected_names.json')
+
+# the credentials are not used to parse recorded events
+APIS = {
+    'OhMyRocknessAPI': lambda: OhMyRocknessAPI(token='', user_agent=''),
+    'SeatGeekAPI': lambda: SeatGeekAPI(client_id='', client_secret='')
+}
+
+
+def recorded_events(checkpoint):
+    apis = {}
+    source_ids = set()
+    for key, raw_events in checkpoint.data.items():
+        source = json.loads(key)[0]
+        if source not in APIS:
+            # not a page of events, e.g. a spotify lookup
+            continue
+        if source not in apis:
+            apis[source] = APIS[source]()
+        for raw_event in raw_events:
+            event = apis[source]._parse_event(raw_event)
+            if (source, event.source_id) in source_ids:
+                continue
+            source_ids.add((source, event.source_id))
+            yield event
+
+
+def load_expected(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def print_wrong_splits(wrong):
+    for name, expected_performers, performers in wrong:
+        print('    {!r}: expected {!r}, got {!r}'.format(
+            name, expected_performers, performers
+        ))
+
+
+def wrong_splits(expected, names=None):
+    """
+    Find listing names that are not normalized to the expected performers
+
+    Parameters
+    ----------
+    expected: (dict) maps listing names to lists of performer names
+    names: (iterable of str) if provided, only these listing names
+        are checked
+
+    Returns
+    -------
+    a list of (name, expected performers, normalized performers) tuples
+    """
+    if names is None:
+        names = expected
+    wrong = []
+    for name in sorted(set(names) & set(expected)):
+        performers = normalize_performer_name(name)
+        if performers != expected[name]:
+            wrong.append((name, expected[name], performers))
+    return wrong
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 3:
+        print(__doc__)
+        sys.exit(1)
+    path = sys.argv[1] if len(sys.argv) >= 2 else SAMPLE
+    if len(sys.argv) == 3:
+        splits = load_expected(sys.argv[2])
+    elif path == SAMPLE:
+        splits = load_expected(SAMPLE_EXPECTED)
+    else:
+        splits = {}
+
+    events = list(recorded_events(Checkpoint(path)))
+    performers = [
+        performer for event in events
+        for performer in event.performers
+    ]
+    entity_sources = SpotifyPlaylist.performer_entity_sources
+    names = set(performer.name for performer in performers)
+    listing_names = set(
+        performer.name for performer in performers
+        if performer.source not in entity_sources
+    )
+    entity_names = set(
+        performer.name for performer in performers
+        if performer.source in entity_sources
+    )
+    normalized_names = canonical_performer_names(
+        listing_names,
+        entity_names=entity_names
+    )
+
+    print('Events: {}'.format(len(events)))
+    print('Lookups before normalization: {}'.format(len(names)))
+    print('Lookups after normalization: {}'.format(len(normalized_names)))
+    if names:
+        print('Reduction: {:.1f}%'.format(
+            100.0 * (1 - float(len(normalized_names)) / len(names))
+        ))
+
+    checked = listing_names & set(splits)
+    if checked:
+        # the lookups that splitting every listing correctly would make
+        expected_names = set(entity_names)
+        for name in checked:
+            expected_names.update(splits[name])
+        expected_names = canonical_performer_names(
+            listing_names - checked,
+            entity_names=expected_names
+        )
+        print('Lookups with the expected splits: {}'.format(
+            len(expected_names)
+        ))
+        wrong = wrong_splits(splits, checked)
+        print('Wrong splits in recorded listings: {} of {}'.format(
+            len(wrong), len(checked)
+        ))
+        print_wrong_splits(wrong)
+
+    expected = load_expected(EXPECTED)
+    wrong = wrong_splits(expected)
+    print('Wrong splits in regression cases: {} of {}'.format(
+        len(wrong), len(expected)
+    ))
+    print_wrong_splits(wrong)
+    if wrong:
+        sys.exit(1)
@@ -2,5 +2,16 @@ from local_concert_playlist.api import (
     OhMyRocknessAPI,
     SeatGeekAPI
 )
-from local_concert_playlist.model import filter_events
+from local_concert_playlist.model import (
+    canonical_performer_names,
+    filter_events,
+    normalize_performer_name
+)
 from local_concert_playlist.spotify_playlist import SpotifyPlaylist
+from local_concert_playlist.pipeline import PlaylistPipeline
+from local_concert_playlist.resilience import (
+    Checkpoint,
+    CircuitOpenError,
+    EmptyResponseError,
+    Resilience
+)
@@ -1,9 +1,26 @@
 import datetime
+import json
+from multiprocessing.pool import ThreadPool
 import os
 import urllib
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+try:
+    from urlparse import urlparse
+except ImportError:
+    from urllib.parse import urlparse
 
 import requests
 
+from local_concert_playlist.resilience import default_resilience
+
+try:
+    string_types = basestring  # json query values are unicode in python 2
+except NameError:
+    string_types = str
+
 
 class APIInterface(object):
     """
@@ -11,6 +28,9 @@ class APIInterface(object):
     """
     input_date_format = "%Y-%m-%d"  # the date format for specifying dates
     output_date_format = "%Y-%m-%d"  # the date format that the API uses for specifying dates
+    resilience = default_resilience  # retries / circuit breaking for requests
+    reuse_sessions = False  # reuse pooled requests.Sessions between requests
+    end_date_inclusive = True  # whether events on the end_date are returned
 
     @property
     def base_url(self):
@@ -49,16 +69,43 @@ class APIInterface(object):
             os.path.join(self.base_url, path),
             urllib.urlencode(params)
         )
-        r = requests.get(url, headers=headers)
-        r.raise_for_status()
-        return r.json()
+
+        def request():
+            r = self._session_get(url, headers=headers)
+            r.raise_for_status()
+            return r.json()
+
+        return self.resilience.call(urlparse(url).netloc, request)
+
+    def _idle_sessions(self):
+        # dict.setdefault is atomic, so all threads share one pool
+        return self.__dict__.setdefault('_sessions', queue.LifoQueue())
+
+    def _session_get(self, url, headers=None):
+        """
+        Make a GET request. If `reuse_sessions` is set, the request is
+        made with an idle `requests.Session` from a pool. Sessions are
+        not documented as thread-safe, so each is used by one request
+        at a time and only returned to the pool once it completes.
+        """
+        if not self.reuse_sessions:
+            return requests.get(url, headers=headers)
+        sessions = self._idle_sessions()
+        try:
+            session = sessions.get_nowait()
+        except queue.Empty:
+            session = requests.Session()
+        try:
+            return session.get(url, headers=headers)
+        finally:
+            sessions.put(session)
 
     def _parse_date(self, date):
         """
         Parse a date string, or a date / datetime object, and output
         a date string in the format expected by the API
         """
-        if isinstance(date, str):
+        if isinstance(date, string_types):
             date = datetime.datetime.strptime(date, self.input_date_format)
         elif isinstance(date, (datetime.date, datetime.datetime)):
             pass
@@ -69,6 +116,24 @@ class APIInterface(object):
             )
         return date.strftime(self.output_date_format)
 
+    def _to_date(self, date):
+        """
+        Convert a date string, or a date / datetime object, into
+        a `datetime.date` object
+        """
+        if isinstance(date, string_types):
+            return datetime.datetime.strptime(
+                date, self.input_date_format
+            ).date()
+        elif isinstance(date, datetime.datetime):
+            return date.date()
+        elif isinstance(date, datetime.date):
+            return date
+        raise ValueError(
+            'expect datetime.date objects or string dates with format {}'
+            .format(self.input_date_format)
+        )
+
     def events(self, per_page=50, page=1, **kwargs):
         """
         Abstract method:
@@ -105,36 +170,252 @@ class APIInterface(object):
     def parsed_events(self,
                       limit=250,
                       per_page=50,
+                      shard=None,
+                      max_workers=4,
+                      checkpoint=None,
                       **kwargs):
         """
         Query the API for events and return a list of `Event` objects
 
         Parameters
         ----------
-        limit (int): the maximum number of responses to return
+        limit (int): the maximum number of responses to return. Without
+            sharding these are the first `limit` events in the order the
+            API sorts them (e.g. by score for SeatGeek), with sharding
+            they are the earliest `limit` events in the date range
         per_page (int): the maximum number of responses to request
             on each API call
+        shard (str): if None, page through a single query. Otherwise
+            the `start_date` / `end_date` range is split into windows
+            that are fetched independently and in parallel, rather than
+            paging deep into a single query. With 'day' there is one
+            window per day, with 'adaptive' windows whose first page is
+            full are split until each window fits in a single page. Windows
+            are requested earliest first, and no further windows are
+            requested once `limit` events are known.
+        max_workers (int): the number of windows fetched concurrently
+            when sharding
+        checkpoint (Checkpoint): if provided, pages that have already
+            been fetched are read from the checkpoint, and newly fetched
+            pages are recorded in it
         **kwargs: additional optiona accepted by self.events
 
         Returns
         -------
-        A list of `Event` objects
+        A list of `Event` objects. When sharding, events are ordered by
+        date and deduplicated by `source_id`.
         """
+        if shard is not None:
+            return self._sharded_parsed_events(
+                limit=limit,
+                per_page=per_page,
+                shard=shard,
+                max_workers=max_workers,
+                checkpoint=checkpoint,
+                **kwargs
+            )
+
         events = []
-        page = 1
-        while True:
-            e = self.events(per_page=per_page, page=page, **kwargs)
+        for e in self.iter_event_pages(per_page=per_page,
+                                       checkpoint=checkpoint,
+                                       **kwargs):
             events.extend(e)
             if len(events) >= limit:
                 events = events[:limit]
                 break
-            elif len(e) >= per_page:
-                page += 1
-                continue
-            else:
-                break
 
         return [
             self._parse_event(event)
             for event in events
         ]
+
+    def _sharded_parsed_events(self,
+                               limit=250,
+                               per_page=50,
+                               shard='day',
+                               max_workers=4,
+                               checkpoint=None,
+                               start_date=None,
+                               end_date=None,
+                               **kwargs):
+        if shard not in ('day', 'adaptive'):
+            raise ValueError(
+                "shard must be one of None, 'day' or 'adaptive', got {}"
+                .format(shard)
+            )
+        if start_date is None or end_date is None:
+            raise ValueError('sharding requires a start_date and end_date')
+        start_date = self._to_date(start_date)
+        end_date = self._to_date(end_date)
+        if end_date < start_date:
+            raise ValueError('end_date must not be before start_date')
+
+        # windows are (first day, last day) pairs that do not overlap,
+        # covering the same days as a single query would
+        last_day = end_date
+        if not self.end_date_inclusive and end_date > start_date:
+            last_day = end_date - datetime.timedelta(days=1)
+        if shard == 'day':
+            windows = [
+                (start_date + datetime.timedelta(days=i),
+                 start_date + datetime.timedelta(days=i))
+                for i in range((last_day - start_date).days + 1)
+            ]
+        else:
+            windows = [(start_date, last_day)]
+
+        def fetch_window(window):
+            return self._fetch_window(
+                window,
+                per_page=per_page,
+                split=(shard == 'adaptive'),
+                checkpoint=checkpoint,
+                **kwargs
+            )
+
+        # windows are fetched earliest first, max_workers at a time, so
+        # that no more windows are requested once the earliest `limit`
+        # events are known
+        windows.sort()
+        events = []
+        source_ids = set()
+        unsettled = []
+
+        def settle(fetched):
+            for window, raw_events in sorted(fetched, key=lambda w: w[0]):
+                for raw_event in raw_events:
+                    event = self._parse_event(raw_event)
+                    if event.source_id in source_ids:
+                        continue
+                    source_ids.add(event.source_id)
+                    events.append(event)
+
+        pool = ThreadPool(max_workers)
+        try:
+            while windows:
+                batch = windows[:max_workers]
+                windows = windows[max_workers:]
+                results = pool.map(fetch_window, batch)
+                for window, (raw_events, sub_windows) in results:
+                    # the first page of a split window is kept too,
+                    # its events are deduplicated against the halves
+                    unsettled.append((window, raw_events))
+                    windows.extend(sub_windows)
+                windows.sort()
+                if not windows:
+                    break
+                # events in windows that end before every remaining
+                # window starts can not be preceded by unfetched events
+                settle([w for w in unsettled if w[0][1] < windows[0][0]])
+                unsettled = [w for w in unsettled if w[0][1] >= windows[0][0]]
+                if len(events) >= limit:
+                    break
+        finally:
+            pool.close()
+            pool.join()
+
+        settle(unsettled)
+        events.sort(key=lambda event: event.datetime_local)
+        return events[:limit]
+
+    def _fetch_window(self,
+                      window,
+                      per_page=50,
+                      split=False,
+                      checkpoint=None,
+                      **kwargs):
+        """
+        Fetch the raw events in a single date window.
+
+        If the first page comes back full and `split` is set, the window
+        is not paged through, instead it is split into smaller windows
+        that are returned to be fetched separately. The size of these is
+        estimated from the number of days the full page covers, and is
+        at most half of the window. Windows of a single day can not be
+        split, so they are paged through.
+
+        Returns
+        -------
+        a tuple of the window, and a tuple of the list of raw events
+        and the list of sub-windows that remain to be fetched
+        """
+        first_day, last_day = window
+        end_date = last_day
+        if not self.end_date_inclusive:
+            end_date = last_day + datetime.timedelta(days=1)
+        kwargs.update(start_date=first_day, end_date=end_date)
+        e = self._checkpointed_events(checkpoint, per_page, 1, **kwargs)
+        if len(e) < per_page:
+            return window, (e, [])
+
+        days = (last_day - first_day).days + 1
+        if split and days >= 2:
+            # estimate how many days fit in one page from the days that
+            # the full page covers, leaving out one that may be partial
+            page_days = len(set(
+                self._parse_event(event).datetime_local.date()
+                for event in e
+            ))
+            window_days = min(max(page_days - 1, 1), days // 2)
+            sub_windows = []
+            while first_day <= last_day:
+                window_end = min(
+                    first_day + datetime.timedelta(days=window_days - 1),
+                    last_day
+                )
+                sub_windows.append((first_day, window_end))
+                first_day = window_end + datetime.timedelta(days=1)
+            return window, (e, sub_windows)
+
+        events = list(e)
+        for e in self.iter_event_pages(per_page=per_page,
+                                       page=2,
+                                       checkpoint=checkpoint,
+                                       **kwargs):
+            events.extend(e)
+        return window, (events, [])
+
+    def iter_event_pages(self, per_page=50, page=1, checkpoint=None, **kwargs):
+        """
+        Iterate over pages of raw events from the API, requesting the
+        next page only when the consumer asks for it.
+
+        Parameters
+        ----------
+        per_page (int): the maximum number of responses to request
+            on each API call
+        page (int): the index of the first page to request
+        checkpoint (Checkpoint): used to skip pages that have already
+            been fetched, and to record newly fetched pages
+        **kwargs: additional options accepted by self.events
+
+        Returns
+        -------
+        A generator of lists of raw event objects provided by the API
+        """
+        while True:
+            e = self._checkpointed_events(checkpoint, per_page, page, **kwargs)
+            yield e
+            if len(e) < per_page:
+                break
+            page += 1
+
+    def _checkpointed_events(self, checkpoint, per_page, page, **kwargs):
+        """
+        Obtain a page of raw events from the checkpoint if it has been
+        fetched before, otherwise from the API, recording it in the
+        checkpoint
+        """
+        if checkpoint is None:
+            return self.events(per_page=per_page, page=page, **kwargs)
+        key = json.dumps([
+            self.__class__.__name__,
+            per_page,
+            page,
+            sorted((k, str(v)) for k, v in kwargs.items())
+        ])
+        e = checkpoint.get(key)
+        if e is None:
+            e = self.events(per_page=per_page, page=page, **kwargs)
+            checkpoint.set(key, e)
+        return e
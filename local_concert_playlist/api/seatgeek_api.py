@@ -25,6 +25,9 @@ class SeatGeekAPI(APIInterface):
     client_secret (str): SeatGeek API client secret
     """
     base_url = "https://api.seatgeek.com/2"
+    # end_date is sent as datetime_utc.lte, which compares against
+    # midnight at the start of the end_date
+    end_date_inclusive = False
 
     def __init__(self, client_id=None, client_secret=None):
         self.client_id = self._get_credentials(
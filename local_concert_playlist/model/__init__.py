@@ -5,3 +5,7 @@ from local_concert_playlist.model.base import (
     Venue
 )
 from local_concert_playlist.model.filters import filter_events
+from local_concert_playlist.model.names import (
+    canonical_performer_names,
+    normalize_performer_name
+)
@@ -0,0 +1,122 @@
+"""
+Performer names from event listings often contain more than one
+performer ("A w/ B"), or extra information about the performance
+("A (DJ Set)", "A: The Farewell Tour"). These functions turn such names
+into the names that should be looked up on Spotify.
+"""
+import re
+
+
+# separators that are always between two performers. "&", "+", "with"
+# and "vs." are left out, since they are too often part of a single
+# performer's name ("Iron & Wine", "Sleeping With Sirens")
+_SEPARATORS = re.compile(
+    r'\s+w/\s*|\s*\bw/\s+|\s+/\s+|\s*;\s*|'
+    r'\s+(?:feat\.?|ft\.?|featuring)\s+|\s+b2b\s+',
+    re.IGNORECASE
+)
+
+# words that indicate that a bracketed or trailing part of a name
+# describes the performance rather than the performer
+_PERFORMANCE_WORDS = (
+    r'dj\s+set|live|tour|release|show|residency|anniversary|'
+    r'celebration|acoustic|solo|in\s+concert|performing|night|'
+    r'headline|farewell|reunion|plays|set'
+)
+
+_BRACKETED = re.compile(
+    r'\s*[\(\[][^\)\]]*\b(?:{})\b[^\)\]]*[\)\]]'.format(_PERFORMANCE_WORDS),
+    re.IGNORECASE
+)
+
+_TRAILING = re.compile(
+    r'\s*(?:\s-\s|:\s|\s--\s).*\b(?:{})\b.*$'.format(_PERFORMANCE_WORDS),
+    re.IGNORECASE
+)
+
+_SPECIAL_GUESTS = re.compile(
+    r'\s+(?:with|and|\+|&)\s+(?:very\s+)?special\s+guests?$',
+    re.IGNORECASE
+)
+
+_DJ_SET = re.compile(r'\s+(?:\(\s*)?dj\s+set(?:\s*\))?$', re.IGNORECASE)
+
+_PREFIXES = re.compile(
+    r'^(?:an\s+evening\s+with|a\s+night\s+with|'
+    r'special\s+guests?|with\s+special\s+guests?)\s*:?\s+',
+    re.IGNORECASE
+)
+
+# parts of a listing that do not name a performer
+_PLACEHOLDERS = re.compile(
+    r'^(?:(?:very\s+)?special\s+guests?|guests?|'
+    r'(?:and\s+)?(?:many\s+)?more|tba|tbd)$',
+    re.IGNORECASE
+)
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def _clean(name):
+    name = _WHITESPACE.sub(' ', name).strip()
+    name = _BRACKETED.sub('', name)
+    name = _TRAILING.sub('', name)
+    name = _SPECIAL_GUESTS.sub('', name)
+    name = _DJ_SET.sub('', name)
+    name = _PREFIXES.sub('', name)
+    return name.strip(' -:,')
+
+
+def normalize_performer_name(name, split=True):
+    """
+    Split a performer name from an event listing into the names of
+    the individual performers, with descriptions of the performance
+    removed.
+
+    Parameters
+    ----------
+    name: (str) a performer name from an event listing
+    split: (bool) whether the name may contain several performers,
+        if False the name is only cleaned
+
+    Returns
+    -------
+    a list of performer names, which may be empty
+    """
+    if split:
+        parts = _SEPARATORS.split(_clean(name))
+    else:
+        parts = [name]
+
+    names = []
+    for part in parts:
+        performer = _clean(part)
+        if performer and not _PLACEHOLDERS.match(performer):
+            names.append(performer)
+    return names
+
+
+def canonical_performer_names(names, entity_names=()):
+    """
+    Normalize a collection of performer names, collapsing names that
+    differ only by case or whitespace.
+
+    Parameters
+    ----------
+    names: (iterable of str) performer names from event listings,
+        which may name several performers
+    entity_names: (iterable of str) names of individual performers,
+        such as SeatGeek performers, which are cleaned but not split
+
+    Returns
+    -------
+    a set of performer names to look up
+    """
+    canonical = {}
+    for name in names:
+        for performer in normalize_performer_name(name):
+            canonical.setdefault(performer.lower(), performer)
+    for name in entity_names:
+        for performer in normalize_performer_name(name, split=False):
+            canonical.setdefault(performer.lower(), performer)
+    return set(canonical.values())
@@ -0,0 +1,304 @@
+"""
+A pipelined alternative to running the playlist workflow one stage
+at a time. Event pages are downloaded, parsed / filtered, and resolved
+on Spotify by separate threads that are connected with bounded queues,
+so performers from the first page of events are looked up while later
+pages are still being downloaded.
+"""
+import threading
+import time
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+from local_concert_playlist.model import filter_events
+
+
+_DONE = object()  # sentinel passed downstream when a stage is finished
+
+
+class _Stopped(Exception):
+    """
+    Raised inside of a stage when another stage has failed
+    """
+    pass
+
+
+class StageStats(object):
+    """
+    Bookkeeping for a single pipeline stage.
+
+    `items` is the number of items the stage has processed,
+    `busy_seconds` is the total time spent doing work (summed over all
+    of the threads in the stage), and `elapsed_seconds` is the wall
+    clock time between the stage starting and finishing.
+    """
+
+    def __init__(self, name, unit):
+        self.name = name
+        self.unit = unit
+        self.items = 0
+        self.busy_seconds = 0.0
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self.started_at is None:
+                self.started_at = time.time()
+
+    def _finish(self):
+        with self._lock:
+            self.finished_at = time.time()
+
+    def _record(self, items, seconds):
+        with self._lock:
+            self.items += items
+            self.busy_seconds += seconds
+
+    @property
+    def elapsed_seconds(self):
+        if self.started_at is None:
+            return 0.0
+        finished_at = self.finished_at
+        if finished_at is None:
+            finished_at = time.time()
+        return finished_at - self.started_at
+
+    @property
+    def throughput(self):
+        """
+        The number of items processed per second of wall clock time
+        """
+        elapsed = self.elapsed_seconds
+        if elapsed <= 0:
+            return 0.0
+        return self.items / elapsed
+
+    def __repr__(self):
+        return (
+            '{}: {} {} in {:.2f}s ({:.2f} {}/s, {:.2f}s busy)'
+            .format(
+                self.name,
+                self.items,
+                self.unit,
+                self.elapsed_seconds,
+                self.throughput,
+                self.unit,
+                self.busy_seconds
+            )
+        )
+
+
+class PlaylistPipeline(object):
+    """
+    Select tracks for upcoming events using a pipeline of concurrent
+    stages instead of the sequential `parsed_events` -> `filter_events`
+    -> `select_tracks_for_events` workflow.
+
+    The stages are:
+        fetch: request pages of raw events from the events API
+        parse: parse and filter events, emitting unseen performer names
+        resolve: look up top tracks for each performer on Spotify
+
+    Queues between the stages are bounded, so a fast stage blocks
+    rather than buffering an unbounded amount of data ahead of a
+    slow one. After a run, per-stage throughput is available in
+    `self.stats`.
+
+    Parameters
+    ----------
+    api: (APIInterface) the API used to obtain events
+    playlist: (SpotifyPlaylist) used to look up tracks on Spotify
+    queue_size: (int) the maximum number of items buffered between stages
+    num_resolvers: (int) the number of threads querying Spotify
+    """
+
+    def __init__(self, api, playlist, queue_size=4, num_resolvers=1):
+        if queue_size < 1:
+            raise ValueError('queue_size must be at least 1')
+        if num_resolvers < 1:
+            raise ValueError('num_resolvers must be at least 1')
+        self.api = api
+        self.playlist = playlist
+        self.queue_size = queue_size
+        self.num_resolvers = num_resolvers
+        self.stats = []
+
+    def _put(self, q, item):
+        while True:
+            if self._stop.is_set():
+                raise _Stopped()
+            try:
+                q.put(item, timeout=.1)
+                return
+            except queue.Full:
+                continue
+
+    def _get(self, q):
+        while True:
+            if self._stop.is_set():
+                raise _Stopped()
+            try:
+                return q.get(timeout=.1)
+            except queue.Empty:
+                continue
+
+    def _run_stage(self, stats, target, *args):
+        stats._start()
+        try:
+            target(stats, *args)
+        except _Stopped:
+            pass
+        except Exception as e:
+            with self._lock:
+                if self._error is None:
+                    self._error = e
+            self._stop.set()
+        finally:
+            stats._finish()
+
+    def _fetch(self, stats, pages, limit, per_page, checkpoint, kwargs):
+        remaining = limit
+        t = time.time()
+        for page in self.api.iter_event_pages(per_page=per_page,
+                                              checkpoint=checkpoint,
+                                              **kwargs):
+            page = page[:remaining]
+            remaining -= len(page)
+            stats._record(len(page), time.time() - t)
+            self._put(pages, page)
+            if remaining <= 0:
+                break
+            t = time.time()
+        self._put(pages, _DONE)
+
+    def _parse(self, stats, pages, performer_names, filters):
+        seen = set()
+        while True:
+            page = self._get(pages)
+            if page is _DONE:
+                break
+            t = time.time()
+            events = list(filter_events(
+                [self.api._parse_event(event) for event in page],
+                **filters
+            ))
+            names = [
+                name for name in self.playlist._get_performer_names(events)
+                if name.lower() not in seen
+            ]
+            seen.update(name.lower() for name in names)
+            stats._record(len(page), time.time() - t)
+            for name in names:
+                self._put(performer_names, name)
+        for _ in range(self.num_resolvers):
+            self._put(performer_names, _DONE)
+
+    def _resolve(self, stats, performer_names, tracks,
+                 max_tracks_per_performer, checkpoint):
+        while True:
+            performer_name = self._get(performer_names)
+            if performer_name is _DONE:
+                break
+            t = time.time()
+            performer_tracks = self.playlist._get_tracks_for_performer(
+                performer_name,
+                max_tracks_per_performer=max_tracks_per_performer,
+                checkpoint=checkpoint
+            )
+            time.sleep(self.playlist.spotify_request_timeout)
+            with self._lock:
+                tracks.extend(performer_tracks)
+            stats._record(1, time.time() - t)
+
+    def select_tracks(self,
+                      limit=250,
+                      per_page=50,
+                      filters=None,
+                      max_tracks=30,
+                      max_tracks_per_performer=3,
+                      track_likelihood=None,
+                      offset_popularity=3.0,
+                      checkpoint=None,
+                      **kwargs):
+        """
+        Obtain events from the API and select tracks on Spotify
+        corresponding to the event performers.
+
+        Parameters
+        ----------
+        limit (int): the maximum number of events to obtain from the API
+        per_page (int): the maximum number of events to request
+            on each API call
+        filters (dict): keyword arguments accepted by `filter_events`
+        max_tracks (int): the maximum number of tracks to select
+        max_tracks_per_performer (int): the maximum number of tracks
+            to consider for each performer
+        track_likelihood (function): relative likelihood of selecting
+            a track, as accepted by `SpotifyPlaylist.select_tracks_for_events`
+        offset_popularity (float): minimum popularity used by the
+            default track likelihood
+        checkpoint (Checkpoint): if provided, pages of events and performer
+            lookups that have already completed are read from it, so an
+            interrupted run can be resumed
+        **kwargs: additional options accepted by `self.api.events`
+
+        Returns
+        -------
+        A list of selected tracks
+        """
+        if filters is None:
+            filters = {}
+
+        self._stop = threading.Event()
+        self._error = None
+        self._lock = threading.Lock()
+
+        pages = queue.Queue(maxsize=self.queue_size)
+        performer_names = queue.Queue(maxsize=self.queue_size)
+        tracks = []
+
+        fetch_stats = StageStats('fetch', 'events')
+        parse_stats = StageStats('parse', 'events')
+        resolve_stats = StageStats('resolve', 'performers')
+        self.stats = [fetch_stats, parse_stats, resolve_stats]
+
+        threads = [
+            threading.Thread(
+                target=self._run_stage,
+                args=(fetch_stats, self._fetch,
+                      pages, limit, per_page, checkpoint, kwargs)
+            ),
+            threading.Thread(
+                target=self._run_stage,
+                args=(parse_stats, self._parse,
+                      pages, performer_names, filters)
+            )
+        ] + [
+            threading.Thread(
+                target=self._run_stage,
+                args=(resolve_stats, self._resolve,
+                      performer_names, tracks, max_tracks_per_performer,
+                      checkpoint)
+            )
+            for _ in range(self.num_resolvers)
+        ]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if self._error is not None:
+            raise self._error
+
+        return self.playlist._filter_tracks(
+            self.playlist._deduplicate_tracks(tracks),
+            limit=max_tracks,
+            likelihood=track_likelihood,
+            offset_popularity=offset_popularity
+        )
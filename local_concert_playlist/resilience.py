@@ -0,0 +1,344 @@
+"""
+Tools for making idempotent API requests robust to transient failures:
+bounded retries with exponential backoff, a per-host circuit breaker
+that fails fast during outages, optional hedged duplicate requests for
+slow responses, and a checkpoint log so that an interrupted run can
+resume where it left off.
+"""
+import collections
+import json
+import math
+import os
+import random
+import threading
+import time
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of making a request to a host whose circuit is open
+    """
+    pass
+
+
+class EmptyResponseError(IOError):
+    """
+    Raised when a read-only request returns no result, which clients
+    such as spotipy do after giving up on a 429 or 5xx response.
+    Being an IOError, it is retried like a connection error.
+    """
+    pass
+
+
+def _status_code(exc):
+    """
+    Obtain the http status code associated with an exception raised by
+    `requests` or `spotipy`, if there is one
+    """
+    response = getattr(exc, 'response', None)
+    status = getattr(response, 'status_code', None)
+    if status is None:
+        status = getattr(exc, 'http_status', None)
+    return status
+
+
+def _retry_after(exc):
+    """
+    Obtain the number of seconds to wait from a Retry-After header
+    """
+    headers = getattr(exc, 'headers', None)
+    if headers is None:
+        headers = getattr(getattr(exc, 'response', None), 'headers', None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker(object):
+    """
+    After `failure_threshold` consecutive failures the circuit opens and
+    calls fail immediately with `CircuitOpenError`. Once `reset_timeout`
+    seconds have passed a single trial call is let through: if it
+    succeeds the circuit closes again, otherwise it stays open.
+    """
+    closed = 'closed'
+    open = 'open'
+    half_open = 'half-open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.closed
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.closed:
+                return True
+            if (self.state == self.open and
+                    time.time() - self.opened_at >= self.reset_timeout):
+                self.state = self.half_open
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.closed
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if (self.state == self.half_open or
+                    self.failures >= self.failure_threshold):
+                self.state = self.open
+                self.opened_at = time.time()
+
+
+class Hedger(object):
+    """
+    Keeps a window of recent latencies for a host. Once there are at
+    least `min_samples` of them, a call that has not completed within
+    the `percentile` latency gets a duplicate request, and whichever
+    succeeds first is used.
+    """
+
+    def __init__(self, percentile=95.0, min_samples=20, window=200):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.latencies = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def threshold(self):
+        with self._lock:
+            latencies = sorted(self.latencies)
+        if len(latencies) < self.min_samples:
+            return None
+        index = int(math.ceil(self.percentile / 100.0 * len(latencies))) - 1
+        return latencies[max(index, 0)]
+
+    def _timed(self, fn):
+        t = time.time()
+        result = fn()
+        with self._lock:
+            self.latencies.append(time.time() - t)
+        return result
+
+    def call(self, fn):
+        threshold = self.threshold()
+        if threshold is None:
+            return self._timed(fn)
+
+        results = queue.Queue()
+
+        def run():
+            try:
+                results.put((True, self._timed(fn)))
+            except Exception as e:
+                results.put((False, e))
+
+        def start():
+            thread = threading.Thread(target=run)
+            thread.daemon = True
+            thread.start()
+
+        start()
+        try:
+            outstanding = 1
+            ok, value = results.get(timeout=threshold)
+        except queue.Empty:
+            start()
+            outstanding = 2
+            ok, value = results.get()
+        if not ok and outstanding == 2:
+            # the other request may still succeed
+            ok, value = results.get()
+        if not ok:
+            raise value
+        return value
+
+
+class Resilience(object):
+    """
+    Make idempotent requests with retries, a per-host circuit breaker
+    and optional hedging. A single instance is meant to be shared by
+    everything that talks to the same hosts so that the circuit breaker
+    and latency statistics reflect all of the traffic.
+
+    Parameters
+    ----------
+    max_retries: (int) the number of times a failed request is retried
+    backoff: (float) the wait in seconds before the first retry, doubled
+        (with jitter) for each subsequent retry
+    max_backoff: (float) the maximum wait in seconds between retries
+    retry_statuses: (tuple) http status codes that are retried, requests
+        failing with other status codes are raised immediately
+    failure_threshold: (int) consecutive failures that open a host's circuit
+    reset_timeout: (float) seconds before an open circuit allows a trial
+    hedge_percentile: (float) if set, requests slower than this percentile
+        of recent latencies for the host are duplicated
+    hedge_min_samples: (int) latencies to observe before hedging starts
+    """
+
+    def __init__(self,
+                 max_retries=3,
+                 backoff=.5,
+                 max_backoff=8.0,
+                 retry_statuses=(429, 500, 502, 503, 504),
+                 failure_threshold=5,
+                 reset_timeout=30.0,
+                 hedge_percentile=None,
+                 hedge_min_samples=20):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retry_statuses = set(retry_statuses)
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.breakers = {}
+        self.hedgers = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, host):
+        with self._lock:
+            if host not in self.breakers:
+                self.breakers[host] = CircuitBreaker(
+                    failure_threshold=self.failure_threshold,
+                    reset_timeout=self.reset_timeout
+                )
+            return self.breakers[host]
+
+    def hedger(self, host):
+        with self._lock:
+            if host not in self.hedgers:
+                self.hedgers[host] = Hedger(
+                    percentile=self.hedge_percentile,
+                    min_samples=self.hedge_min_samples
+                )
+            return self.hedgers[host]
+
+    def _is_retryable(self, exc):
+        status = _status_code(exc)
+        if status is not None:
+            return status in self.retry_statuses
+        # connection errors and timeouts (requests exceptions are IOErrors)
+        return isinstance(exc, (IOError, OSError))
+
+    def _wait(self, attempt, exc):
+        wait = _retry_after(exc)
+        if wait is None:
+            wait = min(self.max_backoff, self.backoff * 2 ** attempt)
+            wait *= random.uniform(.5, 1.0)
+        time.sleep(wait)
+
+    def call(self, host, fn):
+        """
+        Call `fn` (which takes no arguments and makes a request to
+        `host`), retrying on transient failures.
+
+        Returns
+        -------
+        the return value of `fn`
+        """
+        breaker = self.breaker(host)
+        hedger = None
+        if self.hedge_percentile is not None:
+            hedger = self.hedger(host)
+
+        attempt = 0
+        while True:
+            if not breaker.allow():
+                raise CircuitOpenError(
+                    'circuit for {} is open after repeated failures'
+                    .format(host)
+                )
+            try:
+                if hedger is not None:
+                    result = hedger.call(fn)
+                else:
+                    result = fn()
+            except Exception as e:
+                if not self._is_retryable(e):
+                    # the host responded, so it is not having an outage,
+                    # this also resolves a half-open trial call
+                    breaker.record_success()
+                    raise
+                breaker.record_failure()
+                if attempt >= self.max_retries:
+                    raise
+                self._wait(attempt, e)
+                attempt += 1
+                continue
+            breaker.record_success()
+            return result
+
+
+# shared by all API objects unless they are given their own
+default_resilience = Resilience()
+
+
+class Checkpoint(object):
+    """
+    A log of completed units of work (pages of events, Spotify lookups
+    for performers) keyed by strings, so that an interrupted run can
+    pick up from where it left off instead of starting over.
+
+    The file holds one json `[key, value]` pair per line. Each new entry
+    is appended, and the file is replayed when the checkpoint is loaded,
+    with later entries for a key replacing earlier ones.
+
+    Parameters
+    ----------
+    path: (str) the location of the checkpoint file, which is created
+        if it does not exist
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.data = {}
+        if os.path.exists(path):
+            self._load()
+
+    def _load(self):
+        with open(self.path) as f:
+            lines = f.read().split('\n')
+        for line in lines:
+            try:
+                key, value = json.loads(line)
+            except ValueError:
+                # blank, or left incomplete by a crash mid-write
+                continue
+            self.data[key] = value
+        if lines[-1]:
+            # start the next entry on a new line after an incomplete one
+            with open(self.path, 'a') as f:
+                f.write('\n')
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self.data
+
+    def get(self, key, default=None):
+        with self._lock:
+            return self.data.get(key, default)
+
+    def set(self, key, value):
+        line = json.dumps([key, value]) + '\n'
+        with self._lock:
+            self.data[key] = value
+            with open(self.path, 'a') as f:
+                f.write(line)
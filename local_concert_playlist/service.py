@@ -0,0 +1,444 @@
+"""
+A long-running local service that builds playlists over a small
+json-over-http API. Unlike running a script for every playlist, the
+service keeps API sessions, the Spotify connection, recently fetched
+events, and Spotify artist / top track lookups in memory, so repeated
+builds only make requests for what they have not seen before.
+Concurrent builds share lookups: if two builds need the same performer,
+Spotify is only queried once.
+
+Usage:
+    python -m local_concert_playlist.service --port 8765
+
+    curl -X POST localhost:8765/playlists -d '{
+        "source": "ohmyrockness",
+        "events": {"start_date": "2018-01-01", "end_date": "2018-01-31",
+                   "limit": 1000},
+        "filters": {"include_city": "New York"},
+        "max_tracks": 50,
+        "playlist_name": "OhMyRockness January 2018 Concerts"
+    }'
+"""
+import argparse
+import collections
+import inspect
+import json
+import threading
+import time
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+from local_concert_playlist.api import (
+    OhMyRocknessAPI,
+    SeatGeekAPI
+)
+from local_concert_playlist.model import filter_events
+from local_concert_playlist.resilience import CircuitOpenError
+from local_concert_playlist.spotify_playlist import SpotifyPlaylist
+
+
+class SharedCache(object):
+    """
+    A thread-safe in-memory cache. When several threads ask for the
+    same missing key at once, the value is computed by one of them
+    while the others wait for it.
+
+    Expired values are removed whenever a value is added, and once
+    there are more than `max_size` values the least recently used
+    ones are removed.
+
+    Parameters
+    ----------
+    ttl: (float) the number of seconds values are kept for,
+        or None to keep them forever
+    max_size: (int) the maximum number of values to keep,
+        or None for no limit
+    """
+
+    def __init__(self, ttl=None, max_size=None):
+        self.ttl = ttl
+        self.max_size = max_size
+        # ordered from least to most recently used
+        self.data = collections.OrderedDict()
+        # (created_at, key) in the order values were added, which is
+        # also the order in which they expire
+        self._expiry = collections.deque()
+        self.pending = {}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self.data)
+
+    def _evict(self, now):
+        if self.ttl is not None:
+            while self._expiry and now - self._expiry[0][0] >= self.ttl:
+                created_at, key = self._expiry.popleft()
+                entry = self.data.get(key)
+                # the key may have been evicted and added again since
+                if entry is not None and entry[1] == created_at:
+                    del self.data[key]
+        if self.max_size is not None:
+            while len(self.data) > self.max_size:
+                self.data.popitem(last=False)
+
+    def get_or_compute(self, key, compute):
+        while True:
+            with self._lock:
+                if key in self.data:
+                    value, created_at = self.data.pop(key)
+                    if self.ttl is None or time.time() - created_at < self.ttl:
+                        self.data[key] = (value, created_at)
+                        self.hits += 1
+                        return value
+                pending = self.pending.get(key)
+                is_owner = pending is None
+                if is_owner:
+                    pending = self.pending[key] = threading.Event()
+            if not is_owner:
+                # once the owner is done the value is either cached,
+                # or the computation failed and this thread retries it
+                pending.wait()
+                continue
+            try:
+                value = compute()
+                with self._lock:
+                    now = time.time()
+                    self.data[key] = (value, now)
+                    if self.ttl is not None:
+                        self._expiry.append((now, key))
+                    self._evict(now)
+                    self.misses += 1
+                return value
+            finally:
+                with self._lock:
+                    del self.pending[key]
+                pending.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self.data),
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+class CachedSpotifyPlaylist(SpotifyPlaylist):
+    """
+    A `SpotifyPlaylist` that keeps artist searches and top tracks in
+    shared in-memory caches, and that reconnects to Spotify when its
+    access token expires.
+
+    Parameters
+    ----------
+    artist_ttl: (float) seconds to keep artist search results
+    top_tracks_ttl: (float) seconds to keep artist top tracks
+    max_artists: (int) the maximum number of artist searches, and of
+        artist top tracks, to keep
+    """
+    # only lookups that reach Spotify are rate limited
+    spotify_request_timeout = 0
+    spotify_lookup_timeout = .03
+
+    def __init__(self,
+                 artist_ttl=7 * 24 * 3600.0,
+                 top_tracks_ttl=24 * 3600.0,
+                 max_artists=50000):
+        super(CachedSpotifyPlaylist, self).__init__()
+        self.artist_index = SharedCache(ttl=artist_ttl, max_size=max_artists)
+        self.top_tracks = SharedCache(ttl=top_tracks_ttl, max_size=max_artists)
+        self._connection_lock = threading.Lock()
+
+    def _spotify_get(self, method, *args, **kwargs):
+        try:
+            return super(CachedSpotifyPlaylist, self)._spotify_get(
+                method, *args, **kwargs
+            )
+        except Exception as e:
+            if getattr(e, 'http_status', None) != 401:
+                raise
+            # the access token has expired, reconnect and try again
+            with self._connection_lock:
+                self.spotify = self._get_spotify_connection()
+            method = getattr(self.spotify, method.__name__)
+            return super(CachedSpotifyPlaylist, self)._spotify_get(
+                method, *args, **kwargs
+            )
+
+    def _search_artist_id(self, performer_name):
+        def search():
+            artist_id = super(CachedSpotifyPlaylist, self)._search_artist_id(
+                performer_name
+            )
+            time.sleep(self.spotify_lookup_timeout)
+            return artist_id
+
+        return self.artist_index.get_or_compute(performer_name.lower(), search)
+
+    def _get_artist_top_tracks(self, artist_id):
+        def top_tracks():
+            tracks = super(CachedSpotifyPlaylist, self)._get_artist_top_tracks(
+                artist_id
+            )
+            time.sleep(self.spotify_lookup_timeout)
+            # only keep the fields that are used to select tracks
+            return [
+                {
+                    'id': track['id'],
+                    'uri': track['uri'],
+                    'name': track['name'],
+                    'popularity': track['popularity']
+                }
+                for track in tracks
+            ]
+
+        return self.top_tracks.get_or_compute(artist_id, top_tracks)
+
+
+class PlaylistService(object):
+    """
+    Builds playlists while keeping API sessions, events and Spotify
+    lookups warm in memory between builds.
+
+    Parameters
+    ----------
+    event_ttl: (float) seconds to keep the events returned by a query
+    max_event_queries: (int) the maximum number of queries to keep
+        events for
+    artist_ttl: (float) seconds to keep artist search results
+    top_tracks_ttl: (float) seconds to keep artist top tracks
+    max_artists: (int) the maximum number of artist lookups to keep
+    """
+    apis = {
+        'ohmyrockness': OhMyRocknessAPI,
+        'seatgeek': SeatGeekAPI
+    }
+
+    def __init__(self,
+                 event_ttl=3600.0,
+                 max_event_queries=32,
+                 artist_ttl=7 * 24 * 3600.0,
+                 top_tracks_ttl=24 * 3600.0,
+                 max_artists=50000):
+        self.playlist = CachedSpotifyPlaylist(
+            artist_ttl=artist_ttl,
+            top_tracks_ttl=top_tracks_ttl,
+            max_artists=max_artists
+        )
+        self.event_store = SharedCache(
+            ttl=event_ttl,
+            max_size=max_event_queries
+        )
+        self._apis = SharedCache()
+
+    def _get_api(self, source):
+        if source not in self.apis:
+            raise ValueError(
+                'unknown source {}, expected one of {}'
+                .format(source, ', '.join(sorted(self.apis)))
+            )
+
+        def connect():
+            api = self.apis[source]()
+            # pooled sessions, each used by one request at a time, since
+            # request handler threads and sharded fetches make requests
+            # concurrently
+            api.reuse_sessions = True
+            return api
+
+        return self._apis.get_or_compute(source, connect)
+
+    def _get_events(self, source, query):
+        api = self._get_api(source)
+        key = json.dumps([source, sorted(query.items())])
+        return self.event_store.get_or_compute(
+            key,
+            lambda: api.parsed_events(**query)
+        )
+
+    def build_playlist(self,
+                       source='ohmyrockness',
+                       events=None,
+                       filters=None,
+                       max_tracks=30,
+                       max_tracks_per_performer=3,
+                       offset_popularity=3.0,
+                       playlist_name=None,
+                       public=False):
+        """
+        Select tracks for upcoming events, and optionally create a playlist
+
+        Parameters
+        ----------
+        source: (str) the events API to use, 'ohmyrockness' or 'seatgeek'
+        events: (dict) keyword arguments accepted by `parsed_events`
+        filters: (dict) keyword arguments accepted by `filter_events`
+        max_tracks: (int) the maximum number of tracks to select
+        max_tracks_per_performer: (int) the maximum number of tracks
+            to consider for each performer
+        offset_popularity: (float) minimum popularity used when
+            selecting tracks
+        playlist_name: (str) if provided, a playlist with this name
+            is created from the selected tracks
+        public: (bool) whether the created playlist is public
+
+        Returns
+        -------
+        a dict describing the selected tracks and the created playlist
+        """
+        t = time.time()
+        all_events = self._get_events(source, events or {})
+        selected_events = list(filter_events(all_events, **(filters or {})))
+        tracks = self.playlist.select_tracks_for_events(
+            selected_events,
+            max_tracks=max_tracks,
+            max_tracks_per_performer=max_tracks_per_performer,
+            offset_popularity=offset_popularity
+        )
+        tracks = [dict(track) for track in tracks]
+
+        playlist_id = None
+        if playlist_name is not None:
+            # create_playlist returns the snapshot from adding the
+            # tracks, which does not include the playlist id
+            playlist = self.playlist._create_empty_playlist(
+                playlist_name,
+                public=public
+            )
+            playlist_id = playlist['id']
+            self.playlist._add_tracks_to_playlist(playlist_id, tracks)
+
+        return {
+            'events': len(all_events),
+            'filtered_events': len(selected_events),
+            'tracks': tracks,
+            'playlist_id': playlist_id,
+            'seconds': time.time() - t
+        }
+
+    def stats(self):
+        return {
+            'event_store': self.event_store.stats(),
+            'artist_index': self.playlist.artist_index.stats(),
+            'top_tracks': self.playlist.top_tracks.stats()
+        }
+
+
+class PlaylistRequestHandler(BaseHTTPRequestHandler):
+    """
+    GET /stats: cache sizes and hit counts
+    POST /playlists: build a playlist, the json body contains keyword
+        arguments accepted by `PlaylistService.build_playlist`
+    """
+
+    def _respond(self, status, body):
+        content = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self._respond(200, self.server.service.stats())
+        else:
+            self._respond(404, {'error': 'not found'})
+
+    def _read_params(self):
+        """
+        Read the keyword arguments for `PlaylistService.build_playlist`
+        from the request body, raising ValueError or TypeError if they
+        are not valid
+        """
+        length = int(self.headers.get('Content-Length', 0))
+        params = json.loads(self.rfile.read(length).decode('utf-8'))
+        if not isinstance(params, dict):
+            raise ValueError('expected a json object')
+        service = self.server.service
+        # raises TypeError for missing or unexpected arguments
+        args = inspect.getcallargs(service.build_playlist, **params)
+        if args['source'] not in service.apis:
+            raise ValueError(
+                'unknown source {}, expected one of {}'
+                .format(args['source'], ', '.join(sorted(service.apis)))
+            )
+        for name in ('events', 'filters'):
+            if args[name] is not None and not isinstance(args[name], dict):
+                raise ValueError('expected {} to be a json object'.format(name))
+        return params
+
+    def do_POST(self):
+        if self.path != '/playlists':
+            self._respond(404, {'error': 'not found'})
+            return
+        try:
+            params = self._read_params()
+        except (ValueError, TypeError) as e:
+            self._respond(400, {'error': str(e)})
+            return
+        try:
+            result = self.server.service.build_playlist(**params)
+        except CircuitOpenError as e:
+            self._respond(503, {'error': str(e)})
+        except Exception as e:
+            self._respond(500, {'error': str(e)})
+        else:
+            self._respond(200, result)
+
+
+class PlaylistServer(ThreadingMixIn, HTTPServer):
+    """
+    An http server that handles each request in its own thread,
+    sharing a single `PlaylistService`
+    """
+    daemon_threads = True
+
+    def __init__(self, address, service):
+        HTTPServer.__init__(self, address, PlaylistRequestHandler)
+        self.service = service
+
+
+def serve(host='127.0.0.1', port=8765, **kwargs):
+    """
+    Run the playlist service until interrupted
+
+    Parameters
+    ----------
+    host: (str) the address to listen on
+    port: (int) the port to listen on
+    **kwargs: additional options accepted by `PlaylistService`
+    """
+    server = PlaylistServer((host, port), PlaylistService(**kwargs))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--event-ttl', type=float, default=3600.0,
+                        help='seconds to keep the events returned by a query')
+    parser.add_argument('--max-event-queries', type=int, default=32,
+                        help='the number of queries to keep events for')
+    args = parser.parse_args()
+    print('Serving playlists on {}:{}'.format(args.host, args.port))
+    serve(
+        args.host,
+        args.port,
+        event_ttl=args.event_ttl,
+        max_event_queries=args.max_event_queries
+    )
@@ -1,3 +1,4 @@
+import json
 import os
 import time
 
@@ -6,6 +7,12 @@ from spotipy import Spotify
 from spotipy.oauth2 import SpotifyClientCredentials
 import spotipy.util
 
+from local_concert_playlist.model import canonical_performer_names
+from local_concert_playlist.resilience import (
+    default_resilience,
+    EmptyResponseError
+)
+
 
 class SpotifyPlaylist(object):
     credentials = {
@@ -19,6 +26,12 @@ class SpotifyPlaylist(object):
         ]
     }
     spotify_request_timeout = .03
+    spotify_host = 'api.spotify.com'
+    resilience = default_resilience  # retries / circuit breaking for lookups
+    normalize_performer_names = True  # split and clean names before search
+    # sources whose performers are individual artists rather than
+    # listing text that may name several performers
+    performer_entity_sources = ('SeatGeekAPI',)
 
     def __init__(self):
         self.spotify = self._get_spotify_connection()
@@ -39,6 +52,8 @@ class SpotifyPlaylist(object):
                 client_secret=self.credentials['SPOTIFY_CLIENT_SECRET']
             )
         )
+        # retries are made by self.resilience, rather than by spotipy
+        spotify.max_get_retries = 1
         return spotify
 
     def _filter_tracks(self,
@@ -81,44 +96,125 @@ class SpotifyPlaylist(object):
             dict(tuple_track) for tuple_track in set(tuple_tracks)
         ]
 
+    def _get_performer_names(self, events):
+        performers = [
+            performer for event in events
+            for performer in event.performers
+        ]
+        if not self.normalize_performer_names:
+            return set(performer.name for performer in performers)
+        return canonical_performer_names(
+            set(
+                performer.name for performer in performers
+                if performer.source not in self.performer_entity_sources
+            ),
+            entity_names=set(
+                performer.name for performer in performers
+                if performer.source in self.performer_entity_sources
+            )
+        )
+
+    def _spotify_get(self, method, *args, **kwargs):
+        """
+        Call a read-only spotify client method with retries
+        """
+        def request():
+            result = method(*args, **kwargs)
+            if result is None:
+                # spotipy returns None when a 429 or 5xx is not resolved
+                raise EmptyResponseError(
+                    'no response from spotify for {}'.format(method.__name__)
+                )
+            return result
+
+        return self.resilience.call(self.spotify_host, request)
+
+    def _search_artist_id(self, performer_name):
+        """
+        Return the spotify id of the best match for a performer,
+        or None if there is no match
+        """
+        artist_search_results = self._spotify_get(
+            self.spotify.search,
+            performer_name,
+            type='artist'
+        )
+        artists = artist_search_results['artists']['items']
+        if len(artists) == 0:
+            return None
+        return artists[0]['id']
+
+    def _get_artist_top_tracks(self, artist_id):
+        top_tracks_results = self._spotify_get(
+            self.spotify.artist_top_tracks,
+            artist_id
+        )
+        return top_tracks_results['tracks']
+
+    def _get_tracks_for_performer(self,
+                                  performer_name,
+                                  max_tracks_per_performer=2,
+                                  checkpoint=None):
+        """
+        Look up a performer on Spotify and return up to
+        `max_tracks_per_performer` of their top tracks. An empty
+        list is returned if the performer cannot be found.
+
+        If a `Checkpoint` is provided, performers that have already
+        been looked up are read from it, and new lookups are recorded.
+        """
+        if checkpoint is not None:
+            key = json.dumps([
+                'spotify',
+                performer_name,
+                max_tracks_per_performer
+            ])
+            tracks = checkpoint.get(key)
+            if tracks is None:
+                tracks = self._get_tracks_for_performer(
+                    performer_name,
+                    max_tracks_per_performer=max_tracks_per_performer
+                )
+                checkpoint.set(key, tracks)
+            return tracks
+
+        artist_id = self._search_artist_id(performer_name)
+        if artist_id is None:
+            # failure to find an artist on spotify
+            return []
+
+        top_tracks = self._get_artist_top_tracks(artist_id)
+
+        tracks = []
+        for i, top_track in enumerate(top_tracks):
+            if i >= max_tracks_per_performer:
+                break
+
+            tracks.append({
+                'performer_name': performer_name,
+                'artist_id': artist_id,
+                'track_id': top_track['id'],
+                'track_uri': top_track['uri'],
+                'track_name': top_track['name'],
+                'track_popularity': top_track['popularity']
+            })
+        return tracks
+
     def _get_tracks_for_events(self,
                                events,
-                               max_tracks_per_performer=2):
+                               max_tracks_per_performer=2,
+                               checkpoint=None):
 
-        performer_names = set(
-            performer.name for event in events
-            for performer in event.performers
-        )
+        performer_names = self._get_performer_names(events)
 
         tracks = []
 
         for performer_name in performer_names:
-            artist_search_results = self.spotify.search(
+            tracks.extend(self._get_tracks_for_performer(
                 performer_name,
-                type='artist'
-            )
-            artists = artist_search_results['artists']['items']
-            if len(artists) == 0:
-                # failure to find an artist on spotify
-                continue
-
-            artist_id = artists[0]['id']
-            top_tracks_results = self.spotify.artist_top_tracks(artist_id)
-            top_tracks = top_tracks_results['tracks']
-
-            for i, top_track in enumerate(top_tracks):
-                if i >= max_tracks_per_performer:
-                    break
-
-                tracks.append({
-                    'performer_name': performer_name,
-                    'artist_id': artist_id,
-                    'track_id': top_track['id'],
-                    'track_uri': top_track['uri'],
-                    'track_name': top_track['name'],
-                    'track_popularity': top_track['popularity']
-                })
-
+                max_tracks_per_performer=max_tracks_per_performer,
+                checkpoint=checkpoint
+            ))
             time.sleep(self.spotify_request_timeout)
         return self._deduplicate_tracks(tracks)
 
@@ -127,11 +223,13 @@ class SpotifyPlaylist(object):
                                  max_tracks=30,
                                  max_tracks_per_performer=3,
                                  track_likelihood=None,
-                                 offset_popularity=3.0):
+                                 offset_popularity=3.0,
+                                 checkpoint=None):
 
         tracks = self._get_tracks_for_events(
             events,
-            max_tracks_per_performer=max_tracks_per_performer
+            max_tracks_per_performer=max_tracks_per_performer,
+            checkpoint=checkpoint
         )
         selected_tracks = self._filter_tracks(
             tracks,
@@ -141,17 +239,25 @@ class SpotifyPlaylist(object):
         )
         return selected_tracks
 
-    def create_playlist(self, playlist_name, tracks, public=False):
-        spotify_username = self.credentials['SPOTIFY_USERNAME']
-        playlist = self.spotify.user_playlist_create(
-            spotify_username,
+    def _create_empty_playlist(self, playlist_name, public=False):
+        return self.spotify.user_playlist_create(
+            self.credentials['SPOTIFY_USERNAME'],
             playlist_name,
             public=public
         )
-        updated_playlist = self.spotify.user_playlist_add_tracks(
-            spotify_username,
-            playlist['id'],
+
+    def _add_tracks_to_playlist(self, playlist_id, tracks):
+        return self.spotify.user_playlist_add_tracks(
+            self.credentials['SPOTIFY_USERNAME'],
+            playlist_id,
             [track['track_uri']
              for track in tracks]
         )
+
+    def create_playlist(self, playlist_name, tracks, public=False):
+        playlist = self._create_empty_playlist(playlist_name, public=public)
+        updated_playlist = self._add_tracks_to_playlist(
+            playlist['id'],
+            tracks
+        )
         return updated_playlist